@@ -1,53 +1,252 @@
+import asyncio
+import contextlib
 import logging
 import os
 from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set
 
+import aiohttp
 from line import Bot
-from linebot.v3.webhooks import MessageEvent
+from linebot.v3.messaging import ReplyMessageRequest, TextMessage
+from linebot.v3.webhooks import MessageEvent, PostbackEvent
 from stock_crawl import StockCrawl
 from tortoise import Tortoise
 
+from .logging import log_duration
 from .models import User
+from .notifier import OrderNotifier
+from .resilience import (
+    DependencyUnavailable,
+    ResultUnknown,
+    breakers,
+    is_transport_error,
+    service_name,
+)
 from .rich_menu import RICH_MENU
-from .shioaji import Shioaji
+from .scheduler import Clock, PreMarketScheduler
+from .shutdown import ShutdownCoordinator, ShuttingDown
+from .snapshot import Snapshot
+
+if TYPE_CHECKING:
+    from .shioaji import Shioaji
 
 log = logging.getLogger(__name__)
 
+STARTING_MESSAGE = "系統啟動中, 請稍後再試"
+SETUP_FAILED_MESSAGE = "永豐金帳戶登入或載入商品檔失敗, 請確認帳戶設定或聯絡管理員"
+SHUTTING_DOWN_MESSAGE = "系統重新啟動中, 請稍後再試"
+RESULT_UNKNOWN_MESSAGE = (
+    "⚠️ 永豐金回應逾時, 無法確認下單/改單/刪單是否成功\n"
+    "請先到「委託查詢」確認結果, 請勿重複操作"
+)
+METRICS_INTERVAL = 300
+CONTRACT_FETCH_ATTEMPTS = 3
+DEPENDENCY_MESSAGES: Dict[str, str] = {
+    "shioaji": "永豐金伺服器目前無法連線, 請稍後再試",
+    "stock_crawl": "股票資料來源目前無法連線, 請稍後再試",
+}
+
+
+def is_crawl_failure(error: BaseException) -> bool:
+    """StockCrawl 的連線錯誤, 伺服器錯誤 (5xx) 與流量限制 (429) 算失敗"""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500 or error.status == 429
+    return isinstance(error, aiohttp.ClientConnectionError) or is_transport_error(
+        error
+    )
+
 
 class StockBuyer(Bot):
-    def __init__(self, *, channel_secret: str, access_token: str) -> None:
+    def __init__(
+        self,
+        *,
+        channel_secret: str,
+        access_token: str,
+        clock: Optional[Clock] = None,
+    ) -> None:
         super().__init__(channel_secret=channel_secret, access_token=access_token)
         self.crawl = StockCrawl()
-        self.shioaji_accs: dict[str, Shioaji] = {}
+        breakers.configure("stock_crawl", is_failure=is_crawl_failure)
+        self.shioaji_accs: dict[str, "Shioaji"] = {}
+        self.snapshot = Snapshot.load(
+            Path(os.getenv("SNAPSHOT_PATH") or "snapshot.json")
+        )
+        self.startup_timings: Dict[str, float] = {}
+        self.ready = asyncio.Event()
+        self.shutdown = ShutdownCoordinator()
+        self.scheduler = PreMarketScheduler(self, clock=clock)
+        self.notifier = OrderNotifier(self)
+
+        self._pending_user_ids: Set[str] = set()
+        self._failed_user_ids: Set[str] = set()
+        self._warmup_task: Optional[asyncio.Task] = None
+        self._scheduler_task: Optional[asyncio.Task] = None
+        self._metrics_task: Optional[asyncio.Task] = None
 
     async def setup_hook(self) -> None:
-        log.info("Setting up database...")
-        await Tortoise.init(
-            db_url=os.getenv("DB_URL") or "sqlite://db.sqlite3",
-            modules={"models": ["stock_buyer.models"]},
-        )
-        await Tortoise.generate_schemas()
+        # Heavy work runs in the background so the webhook can start serving right away
+        self._warmup_task = asyncio.create_task(self._warmup())
+        self._metrics_task = asyncio.create_task(self._log_metrics())
+
+    async def _warmup(self) -> None:
+        try:
+            with log_duration("Startup", self.startup_timings):
+                await self._setup_database()
+                users = await User.all()
+                # Gate every account before handlers are let through, otherwise
+                # users would hit shioaji_accs before their account is set up
+                self._pending_user_ids = {user.id for user in users}
+                self._load_cogs()
+                try:
+                    await self._setup_rich_menu()
+                except Exception:
+                    log.exception("Failed to set up rich menu")
+                self.ready.set()
+                await self._setup_shioaji_accounts(users)
+        except Exception:
+            log.critical("Startup failed, the bot cannot serve requests", exc_info=True)
+            return
+
+        self._save_snapshot()
+        self._scheduler_task = asyncio.create_task(self.scheduler.run())
+
+    def _save_snapshot(self) -> None:
+        try:
+            self.snapshot.save()
+        except OSError:
+            log.exception("Failed to save snapshot")
+
+    async def _setup_database(self) -> None:
+        with log_duration("Setting up database", self.startup_timings):
+            await Tortoise.init(
+                db_url=os.getenv("DB_URL") or "sqlite://db.sqlite3",
+                modules={"models": ["stock_buyer.models"]},
+            )
+            await Tortoise.generate_schemas()
+
+    def _load_cogs(self) -> None:
+        with log_duration("Loading cogs", self.startup_timings):
+            for cog in Path("stock_buyer/cogs").glob("*.py"):
+                log.info("Loading cog %s", cog.stem)
+                self.add_cog(f"stock_buyer.cogs.{cog.stem}")
+
+    async def _setup_rich_menu(self) -> None:
+        with log_duration("Setting up rich menu", self.startup_timings):
+            image_path = Path("assets/rich_menu.png")
+            digest = Snapshot.digest(
+                RICH_MENU.to_json().encode(), image_path.read_bytes()
+            )
+            if (
+                self.snapshot.rich_menu_id is not None
+                and self.snapshot.rich_menu_digest == digest
+            ):
+                try:
+                    default = await self.line_bot_api.get_default_rich_menu_id()
+                except Exception:
+                    default = None
+                if (
+                    default is not None
+                    and default.rich_menu_id == self.snapshot.rich_menu_id
+                ):
+                    log.info("Reusing rich menu %s", self.snapshot.rich_menu_id)
+                    return
+
+            await self.delete_all_rich_menus()
+            rich_menu_id = await self.create_rich_menu(RICH_MENU, str(image_path))
+            await self.line_bot_api.set_default_rich_menu(rich_menu_id)
+            self.snapshot.rich_menu_id = rich_menu_id
+            self.snapshot.rich_menu_digest = digest
+
+    async def _setup_shioaji_accounts(self, users: List[User]) -> None:
+        with log_duration("Setting up shioaji accounts", self.startup_timings):
+            for user in users:
+                try:
+                    shioaji = await self._start_shioaji(user)
+                except Exception:
+                    log.exception("Failed to set up account of user %s", user.id)
+                    self._failed_user_ids.add(user.id)
+                else:
+                    self.notifier.attach(user.id, shioaji)
+                    self.shioaji_accs[user.id] = shioaji
+                finally:
+                    # Only let the user through once contracts are loaded too
+                    self._pending_user_ids.discard(user.id)
 
-        log.info("Loading cogs")
-        for cog in Path("stock_buyer/cogs").glob("*.py"):
-            log.info("Loading cog %s", cog.stem)
-            self.add_cog(f"stock_buyer.cogs.{cog.stem}")
+    async def _start_shioaji(self, user: User) -> "Shioaji":
+        shioaji = user.shioaji
+        await shioaji.start(fetch_contract=False)
+        attempt = 1
+        while True:
+            try:
+                await shioaji.fetch_contracts()
+                return shioaji
+            except Exception:
+                if attempt >= CONTRACT_FETCH_ATTEMPTS:
+                    with contextlib.suppress(Exception):
+                        await shioaji.logout()
+                    raise
+                log.warning(
+                    "Failed to fetch contracts for user %s (attempt %d), retrying",
+                    user.id,
+                    attempt,
+                    exc_info=True,
+                )
+                await asyncio.sleep(attempt * 5)
+                attempt += 1
 
-        log.info("Setting up rich menu")
-        await self.delete_all_rich_menus()
-        rich_menu_id = await self.create_rich_menu(RICH_MENU, "assets/rich_menu.png")
-        await self.line_bot_api.set_default_rich_menu(rich_menu_id)
+    def is_starting(self, user_id: Optional[str]) -> bool:
+        """
+        使用者的帳戶是否仍在啟動中
 
-        log.info("Setting up shioaji accounts")
-        users = await User.all()
-        for user in users:
-            shioaji = user.shioaji
-            await shioaji.start()
-            self.shioaji_accs[user.id] = shioaji
+        Args:
+            user_id (Optional[str]): LINE 使用者 ID
+
+        Returns:
+            bool: 是否仍在啟動中
+        """
+        return not self.ready.is_set() or user_id in self._pending_user_ids
+
+    async def _reply_text(self, reply_token: Optional[str], text: str) -> None:
+        if reply_token is None:
+            return
+        await self.line_bot_api.reply_message(
+            ReplyMessageRequest(
+                reply_token=reply_token, messages=[TextMessage(text=text)]
+            )
+        )
+
+    async def _reply_unavailable(
+        self, user_id: Optional[str], reply_token: Optional[str]
+    ) -> bool:
+        """
+        若使用者的帳戶尚未可用則回覆原因
+
+        Returns:
+            bool: 是否已回覆
+        """
+        if self.is_starting(user_id):
+            await self._reply_text(reply_token, STARTING_MESSAGE)
+            return True
+        if user_id in self._failed_user_ids:
+            await self._reply_text(reply_token, SETUP_FAILED_MESSAGE)
+            return True
+        return False
 
     async def on_message(self, event: MessageEvent) -> None:
         if event.message is None:
             return
+        user_id: Optional[str] = event.source.user_id  # type: ignore
+        if await self._reply_unavailable(user_id, event.reply_token):
+            return
+        try:
+            async with self.shutdown.track():
+                await self._handle_message(event)
+        except ShuttingDown:
+            await self._reply_text(event.reply_token, SHUTTING_DOWN_MESSAGE)
+        except DependencyUnavailable as e:
+            await self._reply_dependency_error(event.reply_token, e)
+
+    async def _handle_message(self, event: MessageEvent) -> None:
         text: str = event.message.text  # type: ignore
         user = await User.get(id=event.source.user_id)  # type: ignore
         if user.temp_data:
@@ -57,8 +256,74 @@ class StockBuyer(Bot):
 
         await super().on_message(event)
 
+    async def on_postback(self, event: PostbackEvent) -> None:
+        user_id: Optional[str] = event.source.user_id  # type: ignore
+        if await self._reply_unavailable(user_id, event.reply_token):
+            return
+        try:
+            async with self.shutdown.track():
+                await super().on_postback(event)
+        except ShuttingDown:
+            await self._reply_text(event.reply_token, SHUTTING_DOWN_MESSAGE)
+        except DependencyUnavailable as e:
+            await self._reply_dependency_error(event.reply_token, e)
+
+    async def _reply_dependency_error(
+        self, reply_token: Optional[str], error: DependencyUnavailable
+    ) -> None:
+        log.warning("%s unavailable: %r", error.name, error)
+        if isinstance(error, ResultUnknown):
+            message = RESULT_UNKNOWN_MESSAGE
+        else:
+            message = DEPENDENCY_MESSAGES.get(
+                service_name(error.name), "系統忙碌中, 請稍後再試"
+            )
+        await self._reply_text(reply_token, message)
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        """
+        取得外部服務斷路器的狀態
+
+        Returns:
+            Dict[str, Dict[str, Any]]: 以服務名稱為 key 的斷路器狀態
+        """
+        return breakers.metrics()
+
+    async def _log_metrics(self) -> None:
+        while True:
+            await asyncio.sleep(METRICS_INTERVAL)
+            metrics = self.metrics()
+            if metrics:
+                log.info("Circuit breakers: %s", metrics)
+
+    async def _cancel_background_tasks(self) -> None:
+        tasks = [
+            task
+            for task in (self._warmup_task, self._scheduler_task, self._metrics_task)
+            if task is not None and not task.done()
+        ]
+        for task in tasks:
+            task.cancel()
+        # Wait for cancellation to land so an in-flight login or refresh() cannot
+        # race the logouts below on the same session
+        await asyncio.gather(*tasks, return_exceptions=True)
+
     async def on_close(self) -> None:
-        await Tortoise.close_connections()
-        await self.crawl.close()
-        for shioaji in self.shioaji_accs.values():
-            await shioaji.logout()
+        with log_duration("Shutdown"):
+            await self.shutdown.drain()
+            warmup_done = self._warmup_task is not None and self._warmup_task.done()
+            await self._cancel_background_tasks()
+            if warmup_done and self.ready.is_set():
+                # Conversation state (User.temp_data) is saved on every step, so
+                # only the snapshot needs to be persisted here
+                self._save_snapshot()
+            # Shioaji.logout is already bounded by LOGOUT_TIMEOUT
+            await self.shutdown.run_all(
+                lambda shioaji: shioaji.logout(), self.shioaji_accs.values()
+            )
+            # Logging out stops the order callbacks, so flush afterwards to push
+            # every event, letting queued call_soon_threadsafe callbacks run first
+            await asyncio.sleep(0)
+            await self.notifier.flush_all()
+            await self.crawl.close()
+            await Tortoise.close_connections()
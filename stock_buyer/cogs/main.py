@@ -14,6 +14,7 @@ from line.models import (
 from shioaji.constant import Status, StockOrderLot
 from shioaji.order import StockOrder
 
+from .. import resilience
 from ..bot import StockBuyer
 from ..models import User
 
@@ -99,14 +100,24 @@ class Main(Cog):
                 "請輸入要下單的股票代號或名稱", quick_reply=KEYBOARD_QUICK_REPLY
             )
 
-        stock = await self.bot.crawl.fetch_stock(stock_id)
+        stock = await resilience.call(
+            "stock_crawl",
+            self.bot.crawl.fetch_stock,
+            stock_id,
+            timeout=resilience.CRAWL_TIMEOUT,
+        )
         if stock is None:
             return await ctx.reply_text(f"找不到代號或名稱為 {stock_id} 的股票")
 
         if price is None:
             user.temp_data = f"cmd=place_order&stock_id={stock_id}&quantity={quantity}&price={{text}}&action={action}&order_lot={order_lot}"
             await user.save()
-            close_price = await self.bot.crawl.fetch_stock_last_close_price(stock.id)
+            close_price = await resilience.call(
+                "stock_crawl",
+                self.bot.crawl.fetch_stock_last_close_price,
+                stock.id,
+                timeout=resilience.CRAWL_TIMEOUT,
+            )
             return await ctx.reply_text(
                 f"請輸入要下單的價格\n\n收盤價: NTD${close_price}",
                 quick_reply=KEYBOARD_QUICK_REPLY,
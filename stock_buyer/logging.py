@@ -1,8 +1,10 @@
 import contextlib
 import logging
 import logging.handlers
+import time
+from typing import Dict, Optional
 
-__all__ = ("setup_logging",)
+__all__ = ("setup_logging", "log_duration")
 
 
 @contextlib.contextmanager
@@ -27,3 +29,22 @@ def setup_logging():
         for handler in handlers:
             handler.close()
             log.removeHandler(handler)
+
+
+@contextlib.contextmanager
+def log_duration(name: str, timings: Optional[Dict[str, float]] = None):
+    """
+    記錄區塊執行時間
+
+    Args:
+        name (str): 階段名稱
+        timings (Optional[Dict[str, float]]): 若有提供, 執行時間 (秒) 會存入此 dict
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if timings is not None:
+            timings[name] = elapsed
+        logging.getLogger(__name__).info("%s took %.2fs", name, elapsed)
@@ -1,9 +1,10 @@
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
 from tortoise import fields
 from tortoise.models import Model
 
-from .shioaji import Shioaji
+if TYPE_CHECKING:
+    from .shioaji import Shioaji
 
 
 class User(Model):
@@ -16,11 +17,15 @@ class User(Model):
     temp_data: fields.Field[Optional[str]] = fields.TextField(null=True)  # type: ignore
 
     @property
-    def shioaji(self) -> Shioaji:
+    def shioaji(self) -> "Shioaji":
+        # shioaji is slow to import, only load it once an account is needed
+        from .shioaji import Shioaji
+
         return Shioaji(
             api_key=self.api_key,
             secret_key=self.secret_key,
             ca_path=self.ca_path,
             ca_passwd=self.ca_passwd,
             person_id=self.person_id,
+            name=f"shioaji:{self.id}",
         )
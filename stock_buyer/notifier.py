@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import threading
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    List,
+    Literal,
+    NamedTuple,
+    Optional,
+    Protocol,
+    Set,
+)
+
+from linebot.v3.messaging import PushMessageRequest, TextMessage
+
+if TYPE_CHECKING:
+    from .bot import StockBuyer
+
+__all__ = (
+    "OrderEvent",
+    "OrderEventSource",
+    "OrderNotifier",
+    "SimulatedOrderEventSource",
+)
+
+log = logging.getLogger(__name__)
+
+ACTION_NAMES: Dict[str, str] = {
+    "Buy": "買",
+    "Sell": "賣",
+}
+EVENTS_PER_MESSAGE = 20
+MESSAGES_PER_PUSH = 5  # LINE 每次推播最多 5 則訊息
+
+
+class OrderEvent(NamedTuple):
+    """
+    委託單成交或刪單事件
+
+    Attributes:
+        kind (Literal["deal", "cancel"]): 事件類型
+        order_id (str): 委託單編號
+        code (str): 股票代號
+        action (str): 交易行為 (Buy/Sell)
+        price (float): 價格
+        quantity (int): 數量
+    """
+
+    kind: Literal["deal", "cancel"]
+    order_id: str
+    code: str
+    action: str
+    price: float
+    quantity: int
+
+    def format(self) -> str:
+        action = ACTION_NAMES.get(self.action, self.action)
+        if self.kind == "deal":
+            return f"✅ 成交 [{self.code}] {action} {self.quantity} @ NTD${self.price} (委託單 {self.order_id})"
+        return f"❌ 已刪單 [{self.code}] {action} {self.quantity} @ NTD${self.price} (委託單 {self.order_id})"
+
+
+class OrderEventSource(Protocol):
+    """可註冊委託單事件 callback 的來源, 例如 Shioaji 帳戶"""
+
+    def set_order_callback(self, callback: Callable[[OrderEvent], None]) -> None:
+        ...
+
+
+class SimulatedOrderEventSource:
+    """
+    模擬的委託單事件來源, 不需連線券商即可送出事件
+
+    與 Shioaji 相同, 只保留最後註冊的 callback, 並預設從其他執行緒呼叫
+    """
+
+    def __init__(self) -> None:
+        self._callback: Optional[Callable[[OrderEvent], None]] = None
+
+    def set_order_callback(self, callback: Callable[[OrderEvent], None]) -> None:
+        self._callback = callback
+
+    def emit(self, event: OrderEvent, *, threaded: bool = True) -> None:
+        """
+        送出事件
+
+        Args:
+            event (OrderEvent): 事件
+            threaded (bool): 是否像 Shioaji 一樣從其他執行緒呼叫 callback
+        """
+        if self._callback is None:
+            return
+        if not threaded:
+            return self._callback(event)
+        thread = threading.Thread(target=self._callback, args=(event,))
+        thread.start()
+        thread.join()
+
+
+class OrderNotifier:
+    """
+    將委託單成交與刪單事件推播到使用者的 LINE 聊天室
+
+    同一使用者在 window 秒內的事件會合併成一次推播
+
+    Args:
+        bot (StockBuyer): 機器人
+        window (float): 合併事件的時間 (秒)
+    """
+
+    def __init__(self, bot: "StockBuyer", *, window: float = 2.0) -> None:
+        self.bot = bot
+        self.window = window
+        self._pending: Dict[str, List[OrderEvent]] = {}
+        self._flush_handles: Dict[str, asyncio.TimerHandle] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def attach(self, user_id: str, source: OrderEventSource) -> None:
+        """
+        監聽 source 的委託單事件並推播給 user_id
+
+        callback 可能在其他執行緒被呼叫, 事件會被轉回 event loop 處理
+
+        Args:
+            user_id (str): LINE 使用者 ID
+            source (OrderEventSource): 事件來源
+        """
+        loop = self._loop = asyncio.get_running_loop()
+
+        def callback(event: OrderEvent) -> None:
+            loop.call_soon_threadsafe(self.submit, user_id, event)
+
+        source.set_order_callback(callback)
+
+    def submit(self, user_id: str, event: OrderEvent) -> None:
+        """
+        加入一個事件, 必須在 event loop 執行緒呼叫
+
+        Args:
+            user_id (str): LINE 使用者 ID
+            event (OrderEvent): 事件
+        """
+        self._pending.setdefault(user_id, []).append(event)
+        if user_id not in self._flush_handles:
+            loop = self._loop or asyncio.get_running_loop()
+            self._flush_handles[user_id] = loop.call_later(
+                self.window, self._schedule_flush, user_id
+            )
+
+    def _schedule_flush(self, user_id: str) -> None:
+        task = asyncio.create_task(self.flush(user_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self, user_id: str) -> None:
+        """推播 user_id 尚未送出的事件"""
+        handle = self._flush_handles.pop(user_id, None)
+        if handle is not None:
+            handle.cancel()
+        events = self._pending.pop(user_id, [])
+        if not events:
+            return
+
+        messages = [
+            TextMessage(
+                text="\n".join(
+                    event.format() for event in events[i : i + EVENTS_PER_MESSAGE]
+                )
+            )
+            for i in range(0, len(events), EVENTS_PER_MESSAGE)
+        ]
+        for i in range(0, len(messages), MESSAGES_PER_PUSH):
+            try:
+                await self.bot.line_bot_api.push_message(
+                    PushMessageRequest(
+                        to=user_id, messages=messages[i : i + MESSAGES_PER_PUSH]
+                    )
+                )
+            except Exception:
+                log.exception("Failed to push order events to user %s", user_id)
+
+    async def flush_all(self) -> None:
+        """推播所有尚未送出的事件"""
+        await asyncio.gather(*(self.flush(user_id) for user_id in list(self._pending)))
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
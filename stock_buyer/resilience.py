@@ -0,0 +1,292 @@
+import asyncio
+import functools
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+__all__ = (
+    "CRAWL_TIMEOUT",
+    "CircuitBreaker",
+    "CircuitBreakerRegistry",
+    "CircuitOpenError",
+    "DependencyTimeout",
+    "DependencyUnavailable",
+    "ResultUnknown",
+    "bounded",
+    "breakers",
+    "call",
+    "is_transport_error",
+    "service_name",
+    "with_timeout",
+)
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+CRAWL_TIMEOUT = 10.0
+
+
+class DependencyUnavailable(Exception):
+    """外部服務無法使用"""
+
+    def __init__(self, name: str) -> None:
+        super().__init__(name)
+        self.name = name
+
+
+class CircuitOpenError(DependencyUnavailable):
+    """斷路器開啟中, 直接拒絕呼叫"""
+
+
+class DependencyTimeout(DependencyUnavailable):
+    """呼叫外部服務逾時"""
+
+
+class ResultUnknown(DependencyTimeout):
+    """不可重試的呼叫 (例如下單) 逾時, 無法確認是否已送達外部服務"""
+
+
+def is_transport_error(error: BaseException) -> bool:
+    """預設的失敗判斷, 只有連線錯誤算失敗"""
+    return isinstance(error, OSError)
+
+
+class CircuitBreaker:
+    """
+    斷路器
+
+    連續失敗 failure_threshold 次後開啟, 開啟期間的呼叫會直接失敗;
+    經過 recovery_timeout 秒後進入半開狀態, 只放行一個探測呼叫,
+    成功則關閉, 失敗則再次開啟
+
+    只有逾時與 is_failure 判斷為失敗的例外 (預設為連線錯誤) 會計入,
+    其他例外 (例如被券商拒絕) 不影響斷路器狀態
+
+    Args:
+        name (str): 外部服務名稱
+        failure_threshold (int): 開啟前允許的連續失敗次數
+        recovery_timeout (float): 開啟後多久開始探測 (秒)
+        is_failure (Callable[[BaseException], bool]): 判斷例外是否計入失敗
+        clock (Callable[[], float]): 時間來源
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 30.0,
+        is_failure: Callable[[BaseException], bool] = is_transport_error,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.is_failure = is_failure
+        self._clock = clock
+
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._stats = {
+            "calls": 0,
+            "failures": 0,
+            "timeouts": 0,
+            "rejected": 0,
+            "opened": 0,
+        }
+
+    @property
+    def state(self) -> str:
+        if (
+            self._state == self.OPEN
+            and self._clock() - self._opened_at >= self.recovery_timeout
+        ):
+            self._set_state(self.HALF_OPEN)
+        return self._state
+
+    def _set_state(self, state: str) -> None:
+        if state == self._state:
+            return
+        log.info("Circuit %s: %s -> %s", self.name, self._state, state)
+        self._state = state
+        if state == self.OPEN:
+            self._opened_at = self._clock()
+            self._stats["opened"] += 1
+
+    async def call(
+        self,
+        func: Callable[..., Awaitable[T]],
+        *args: Any,
+        timeout: Optional[float] = None,
+        idempotent: bool = True,
+        **kwargs: Any,
+    ) -> T:
+        """
+        透過斷路器呼叫 func
+
+        Args:
+            func (Callable[..., Awaitable[T]]): 要呼叫的函式
+            timeout (Optional[float]): 逾時秒數, None 表示不限制
+            idempotent (bool): 呼叫是否可安全重試
+
+        Raises:
+            CircuitOpenError: 斷路器開啟中
+            DependencyTimeout: 可重試的呼叫逾時
+            ResultUnknown: 不可重試的呼叫逾時
+        """
+        state = self.state
+        if state == self.OPEN or (state == self.HALF_OPEN and self._probing):
+            self._stats["rejected"] += 1
+            raise CircuitOpenError(self.name)
+
+        probe = state == self.HALF_OPEN
+        if probe:
+            self._probing = True
+        self._stats["calls"] += 1
+        try:
+            result = await asyncio.wait_for(func(*args, **kwargs), timeout)
+        except asyncio.TimeoutError:
+            self._stats["timeouts"] += 1
+            self._record_failure()
+            if not idempotent:
+                raise ResultUnknown(self.name) from None
+            raise DependencyTimeout(self.name) from None
+        except Exception as e:
+            if self.is_failure(e):
+                self._record_failure()
+            raise
+        else:
+            self._record_success()
+            return result
+        finally:
+            if probe:
+                self._probing = False
+
+    def _record_success(self) -> None:
+        self._failures = 0
+        self._set_state(self.CLOSED)
+
+    def _record_failure(self) -> None:
+        self._stats["failures"] += 1
+        self._failures += 1
+        if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            self._set_state(self.OPEN)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self._failures,
+            **self._stats,
+        }
+
+
+class CircuitBreakerRegistry:
+    """
+    依外部服務名稱管理斷路器
+
+    名稱可以用 "服務:範圍" 的格式 (例如 "shioaji:<使用者 ID>") 將同一服務
+    拆成多個斷路器, 設定則依服務名稱共用
+    """
+
+    def __init__(self) -> None:
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._options: Dict[str, Dict[str, Any]] = {}
+
+    def configure(self, service: str, **options: Any) -> None:
+        """
+        設定服務的斷路器參數, 只影響之後建立的斷路器
+
+        Args:
+            service (str): 服務名稱
+            **options: CircuitBreaker 的參數
+        """
+        self._options[service] = options
+
+    def get(self, name: str) -> CircuitBreaker:
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            options = self._options.get(service_name(name), {})
+            breaker = self._breakers[name] = CircuitBreaker(name, **options)
+        return breaker
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        return {name: breaker.metrics() for name, breaker in self._breakers.items()}
+
+
+breakers = CircuitBreakerRegistry()
+
+
+def service_name(name: str) -> str:
+    """取得斷路器名稱中的服務名稱, 例如 shioaji:U123 的服務名稱為 shioaji"""
+    return name.partition(":")[0]
+
+
+async def call(
+    name: str,
+    func: Callable[..., Awaitable[T]],
+    *args: Any,
+    timeout: Optional[float] = None,
+    idempotent: bool = True,
+    **kwargs: Any,
+) -> T:
+    """
+    透過名稱為 name 的斷路器呼叫 func
+
+    Args:
+        name (str): 外部服務名稱
+        func (Callable[..., Awaitable[T]]): 要呼叫的函式
+        timeout (Optional[float]): 逾時秒數
+        idempotent (bool): 呼叫是否可安全重試
+
+    Raises:
+        CircuitOpenError: 斷路器開啟中
+        DependencyTimeout: 可重試的呼叫逾時
+        ResultUnknown: 不可重試的呼叫逾時
+    """
+    return await breakers.get(name).call(
+        func, *args, timeout=timeout, idempotent=idempotent, **kwargs
+    )
+
+
+async def with_timeout(
+    name: str,
+    func: Callable[..., Awaitable[T]],
+    *args: Any,
+    timeout: float,
+    **kwargs: Any,
+) -> T:
+    """
+    只限制時間, 不經過斷路器, 用於登入等啟動與維護流程
+
+    Args:
+        name (str): 外部服務名稱
+        func (Callable[..., Awaitable[T]]): 要呼叫的函式
+        timeout (float): 逾時秒數
+
+    Raises:
+        DependencyTimeout: 呼叫逾時
+    """
+    try:
+        return await asyncio.wait_for(func(*args, **kwargs), timeout)
+    except asyncio.TimeoutError:
+        raise DependencyTimeout(name) from None
+
+
+def bounded(name: str, *, timeout: float):
+    """以逾時包裝 async 函式, 不經過斷路器"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await with_timeout(name, func, *args, timeout=timeout, **kwargs)
+
+        return wrapper
+
+    return decorator
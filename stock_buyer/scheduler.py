@@ -0,0 +1,165 @@
+import asyncio
+import datetime
+import logging
+import os
+from typing import TYPE_CHECKING, Iterable, Optional, Set
+
+from . import resilience
+from .logging import log_duration
+
+if TYPE_CHECKING:
+    from .bot import StockBuyer
+    from .shioaji import Shioaji
+
+__all__ = ("Clock", "TradingCalendar", "PreMarketScheduler", "TAIPEI")
+
+log = logging.getLogger(__name__)
+
+TAIPEI = datetime.timezone(datetime.timedelta(hours=8), "Asia/Taipei")
+
+
+class Clock:
+    """系統時鐘, 測試時可替換成假的時鐘"""
+
+    def now(self) -> datetime.datetime:
+        return datetime.datetime.now(TAIPEI)
+
+    async def sleep(self, seconds: float) -> None:
+        await asyncio.sleep(seconds)
+
+
+class TradingCalendar:
+    """
+    台股交易日曆, 週末與休市日不開盤
+
+    Args:
+        holidays (Iterable[datetime.date]): 休市日
+    """
+
+    def __init__(self, holidays: Iterable[datetime.date] = ()) -> None:
+        self.holidays: Set[datetime.date] = set(holidays)
+
+    @classmethod
+    def from_env(cls) -> "TradingCalendar":
+        """從環境變數 MARKET_HOLIDAYS (以逗號分隔的 YYYY-MM-DD) 讀取休市日"""
+        value = os.getenv("MARKET_HOLIDAYS") or ""
+        return cls(
+            datetime.date.fromisoformat(day.strip())
+            for day in value.split(",")
+            if day.strip()
+        )
+
+    def is_trading_day(self, day: datetime.date) -> bool:
+        return day.weekday() < 5 and day not in self.holidays
+
+    def next_trading_day(self, day: datetime.date) -> datetime.date:
+        """
+        取得 day 當天或之後的第一個交易日
+
+        Args:
+            day (datetime.date): 起始日
+
+        Returns:
+            datetime.date: 交易日
+        """
+        while not self.is_trading_day(day):
+            day += datetime.timedelta(days=1)
+        return day
+
+
+class PreMarketScheduler:
+    """
+    在開盤前預熱永豐金連線與股票資料快取
+
+    Args:
+        bot (StockBuyer): 機器人
+        clock (Optional[Clock]): 時鐘
+        calendar (Optional[TradingCalendar]): 交易日曆
+        warmup_time (datetime.time): 預熱開始時間 (台北時間), 需早於 08:30 的盤前委託時段
+        spacing (float): 每個帳戶之間間隔的秒數, 避免超過 API 流量限制
+        crawl_spacing (float): 每檔股票之間間隔的秒數, 避免超過資料來源流量限制
+    """
+
+    def __init__(
+        self,
+        bot: "StockBuyer",
+        *,
+        clock: Optional[Clock] = None,
+        calendar: Optional[TradingCalendar] = None,
+        warmup_time: datetime.time = datetime.time(8, 0),
+        spacing: float = 5.0,
+        crawl_spacing: float = 1.0,
+    ) -> None:
+        self.bot = bot
+        self.clock = clock or Clock()
+        self.calendar = calendar or TradingCalendar.from_env()
+        self.warmup_time = warmup_time
+        self.spacing = spacing
+        self.crawl_spacing = crawl_spacing
+
+    def next_run(self) -> datetime.datetime:
+        """
+        取得下一次預熱的時間
+
+        Returns:
+            datetime.datetime: 下一次預熱的時間
+        """
+        now = self.clock.now().astimezone(TAIPEI)
+        day = self.calendar.next_trading_day(now.date())
+        run_at = datetime.datetime.combine(day, self.warmup_time, TAIPEI)
+        if run_at <= now:
+            day = self.calendar.next_trading_day(day + datetime.timedelta(days=1))
+            run_at = datetime.datetime.combine(day, self.warmup_time, TAIPEI)
+        return run_at
+
+    async def run(self) -> None:
+        while True:
+            run_at = self.next_run()
+            log.info("Next pre-market warmup at %s", run_at.isoformat())
+            delay = (run_at - self.clock.now()).total_seconds()
+            if delay > 0:
+                await self.clock.sleep(delay)
+            try:
+                await self.warmup()
+            except Exception:
+                log.exception("Pre-market warmup failed")
+
+    async def warmup(self) -> None:
+        with log_duration("Pre-market warmup"):
+            stock_ids: Set[str] = set()
+            accounts = list(self.bot.shioaji_accs.items())
+            for i, (user_id, shioaji) in enumerate(accounts):
+                if i:
+                    await self.clock.sleep(self.spacing)
+                try:
+                    stock_ids.update(await self._warmup_account(shioaji))
+                except Exception:
+                    log.exception("Failed to warm up account of user %s", user_id)
+
+            for i, stock_id in enumerate(sorted(stock_ids)):
+                if i:
+                    await self.clock.sleep(self.crawl_spacing)
+                try:
+                    stock = await resilience.call(
+                        "stock_crawl",
+                        self.bot.crawl.fetch_stock,
+                        stock_id,
+                        timeout=resilience.CRAWL_TIMEOUT,
+                    )
+                    if stock is not None:
+                        await resilience.call(
+                            "stock_crawl",
+                            self.bot.crawl.fetch_stock_last_close_price,
+                            stock.id,
+                            timeout=resilience.CRAWL_TIMEOUT,
+                        )
+                except Exception:
+                    log.exception("Failed to warm up stock %s", stock_id)
+
+    async def _warmup_account(self, shioaji: "Shioaji") -> Set[str]:
+        await shioaji.refresh()
+        await shioaji.fetch_contracts()
+        # Positions are only fetched to know which stocks to warm in StockCrawl,
+        # broker results are not cached so prefetching them would not help
+        positions = await shioaji.list_positions()
+        return {position.code for position in positions}
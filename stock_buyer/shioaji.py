@@ -1,23 +1,86 @@
 import asyncio
-from typing import List, Literal, Optional, Union
+import functools
+from typing import Any, Callable, Dict, List, Literal, Optional, TypeVar, Union
 
 import shioaji as sj
 from shioaji.account import StockAccount
-from shioaji.constant import Action, OrderType, StockOrderLot, StockPriceType
+from shioaji.constant import (
+    Action,
+    OrderState,
+    OrderType,
+    StockOrderLot,
+    StockPriceType,
+)
 from shioaji.contracts import Contract
 from shioaji.error import TokenError
 from shioaji.order import Trade
 from shioaji.position import FuturePosition, StockPosition
 
+from . import resilience
+from .notifier import OrderEvent
+from .resilience import bounded, with_timeout
+
+T = TypeVar("T")
+
+LOGIN_TIMEOUT = 30.0
+LOGOUT_TIMEOUT = 10.0
+FETCH_CONTRACTS_TIMEOUT = 120.0
+CONTRACTS_WAIT_TIMEOUT = 10.0
+QUERY_TIMEOUT = 10.0
+LIST_TRADES_TIMEOUT = 15.0
+# Orders are not safe to retry, so give the broker more time before giving up
+ORDER_TIMEOUT = 30.0
+
+
+def to_order_event(stat: OrderState, msg: Dict[str, Any]) -> Optional[OrderEvent]:
+    """
+    將 Shioaji 的委託回報轉換成成交或刪單事件
+
+    Args:
+        stat (OrderState): 回報類型
+        msg (Dict[str, Any]): 回報內容
+
+    Returns:
+        Optional[OrderEvent]: 事件, 若不是成交或刪單成功則為 None
+    """
+    if stat is OrderState.StockDeal:
+        return OrderEvent(
+            kind="deal",
+            order_id=msg["trade_id"],
+            code=msg["code"],
+            action=str(msg["action"]),
+            price=msg["price"],
+            quantity=msg["quantity"],
+        )
+    if stat is OrderState.StockOrder:
+        operation = msg.get("operation", {})
+        if operation.get("op_type") != "Cancel" or operation.get("op_code") != "00":
+            return None
+        order = msg["order"]
+        return OrderEvent(
+            kind="cancel",
+            order_id=order["id"],
+            code=msg["contract"]["code"],
+            action=str(order["action"]),
+            price=order["price"],
+            # order["quantity"] is the original size, partially filled orders
+            # only cancel what is left
+            quantity=msg["status"]["cancel_quantity"],
+        )
+    return None
+
 
 def handle_token_error(func):
-    async def wrapper(*args, **kwargs):
+    @functools.wraps(func)
+    async def wrapper(self: "Shioaji", *args, **kwargs):
+        # Wait out a refresh in progress instead of racing it on the same session
+        await self._session_ready.wait()
+        generation = self._session_generation
         try:
-            return await func(*args, **kwargs)
+            return await func(self, *args, **kwargs)
         except TokenError:
-            await args[0].logout()
-            await args[0].login()
-            return await func(*args, **kwargs)
+            await self._relogin(generation)
+            return await func(self, *args, **kwargs)
 
     return wrapper
 
@@ -31,7 +94,11 @@ class Shioaji:
         ca_path: str,
         ca_passwd: str,
         person_id: str,
+        name: str = "shioaji",
     ):
+        # Breaker name, one per account so a single account cannot open the
+        # circuit for everyone
+        self.name = name
         self.__api_key = api_key
         self.__secret_key = secret_key
         self.__ca_path = ca_path
@@ -39,6 +106,11 @@ class Shioaji:
         self.__person_id = person_id
         self.api = sj.Shioaji()
         self.stock_account: Optional[StockAccount] = None
+        self._contracts_ready = asyncio.Event()
+        self._session_lock = asyncio.Lock()
+        self._session_ready = asyncio.Event()
+        self._session_ready.set()
+        self._session_generation = 0
 
     async def __aenter__(self) -> "Shioaji":
         await self.start()
@@ -47,19 +119,65 @@ class Shioaji:
     async def __aexit__(self, exc_type, exc, tb) -> None:
         await self.logout()
 
-    async def start(self) -> None:
-        await self.login()
+    async def start(self, *, fetch_contract: bool = True) -> None:
+        """
+        登入並啟用憑證
+
+        Args:
+            fetch_contract (bool): 是否在登入時下載商品檔, 若為 False 需另外呼叫 fetch_contracts
+        """
+        await self.login(fetch_contract=fetch_contract)
         await self.activate_ca()
         if not isinstance(self.api.stock_account, StockAccount):
             raise RuntimeError("無法取得股票帳號")
         self.stock_account = self.api.stock_account
 
-    async def login(self) -> None:
-        await asyncio.to_thread(self.api.login, self.__api_key, self.__secret_key)
+    @bounded("shioaji", timeout=LOGIN_TIMEOUT)
+    async def login(self, *, fetch_contract: bool = True) -> None:
+        await asyncio.to_thread(
+            self.api.login,
+            self.__api_key,
+            self.__secret_key,
+            fetch_contract=fetch_contract,
+        )
+        if fetch_contract:
+            self._contracts_ready.set()
+
+    @bounded("shioaji", timeout=FETCH_CONTRACTS_TIMEOUT)
+    async def fetch_contracts(self) -> None:
+        """載入商品檔, 本機快取仍有效時不會重新下載"""
+        await asyncio.to_thread(self.api.fetch_contracts, contract_download=False)
+        self._contracts_ready.set()
 
+    @bounded("shioaji", timeout=LOGOUT_TIMEOUT)
     async def logout(self) -> None:
         await asyncio.to_thread(self.api.logout)
 
+    async def refresh(self) -> None:
+        """重新登入以取得新的 token, 期間其他呼叫會等待重新登入完成"""
+        async with self._session_lock:
+            self._session_ready.clear()
+            try:
+                await self.logout()
+                await self.start(fetch_contract=False)
+                self._session_generation += 1
+            finally:
+                self._session_ready.set()
+
+    async def _relogin(self, generation: int) -> None:
+        async with self._session_lock:
+            if generation != self._session_generation:
+                # Another call already logged in again after this token expired
+                return
+            self._session_ready.clear()
+            try:
+                await self.logout()
+                await self.login(fetch_contract=False)
+                self._session_generation += 1
+            finally:
+                self._session_ready.set()
+
+    @bounded("shioaji", timeout=LOGIN_TIMEOUT)
     async def activate_ca(self) -> None:
         await asyncio.to_thread(
             self.api.activate_ca,
@@ -68,9 +186,53 @@ class Shioaji:
             person_id=self.__person_id,
         )
 
+    async def _call(
+        self,
+        func: Callable[..., T],
+        *args: Any,
+        timeout: float,
+        idempotent: bool = True,
+        **kwargs: Any,
+    ) -> T:
+        """
+        在執行緒中呼叫券商 API, 並套用此帳戶的斷路器與逾時
+
+        Session 的等待與重新登入不經過這裡, 只有實際的券商呼叫會計時
+
+        Args:
+            func (Callable[..., T]): Shioaji API
+            timeout (float): 逾時秒數
+            idempotent (bool): 呼叫是否可安全重試
+        """
+        return await resilience.call(
+            self.name,
+            asyncio.to_thread,
+            func,
+            *args,
+            timeout=timeout,
+            idempotent=idempotent,
+            **kwargs,
+        )
+
+    def set_order_callback(self, callback: Callable[[OrderEvent], None]) -> None:
+        """
+        註冊成交與刪單事件的 callback, callback 會在 Shioaji 的執行緒被呼叫
+
+        Args:
+            callback (Callable[[OrderEvent], None]): callback
+        """
+
+        def on_order(stat: OrderState, msg: Dict[str, Any]) -> None:
+            event = to_order_event(stat, msg)
+            if event is not None:
+                callback(event)
+
+        self.api.set_order_callback(on_order)
+
     @handle_token_error
     async def get_account_balance(self) -> int:
-        return round((await asyncio.to_thread(self.api.account_balance)).acc_balance)
+        balance = await self._call(self.api.account_balance, timeout=QUERY_TIMEOUT)
+        return round(balance.acc_balance)
 
     @handle_token_error
     async def get_contract(self, stock_id: str) -> Optional[Contract]:
@@ -83,6 +245,9 @@ class Shioaji:
         Returns:
             Optional[Contract]: 商品檔
         """
+        await with_timeout(
+            self.name, self._contracts_ready.wait, timeout=CONTRACTS_WAIT_TIMEOUT
+        )
         return await asyncio.to_thread(self.api.Contracts.Stocks.__getitem__, stock_id)
 
     @handle_token_error
@@ -120,8 +285,13 @@ class Shioaji:
             order_lot=StockOrderLot(order_lot),
             account=self.stock_account,
         )
-        trade = await asyncio.to_thread(self.api.place_order, contract, order)
-        return trade
+        return await self._call(
+            self.api.place_order,
+            contract,
+            order,
+            timeout=ORDER_TIMEOUT,
+            idempotent=False,
+        )
 
     @handle_token_error
     async def list_positions(self) -> List[Union[StockPosition, FuturePosition]]:
@@ -136,7 +306,9 @@ class Shioaji:
         """
         if self.stock_account is None:
             raise RuntimeError("尚未登入")
-        return await asyncio.to_thread(self.api.list_positions, self.stock_account)
+        return await self._call(
+            self.api.list_positions, self.stock_account, timeout=QUERY_TIMEOUT
+        )
 
     @handle_token_error
     async def list_trades(self) -> List[Trade]:
@@ -152,8 +324,10 @@ class Shioaji:
         if self.stock_account is None:
             raise RuntimeError("尚未登入")
 
-        await asyncio.to_thread(self.api.update_status, self.stock_account)
-        return await asyncio.to_thread(self.api.list_trades)
+        await self._call(
+            self.api.update_status, self.stock_account, timeout=LIST_TRADES_TIMEOUT
+        )
+        return await self._call(self.api.list_trades, timeout=QUERY_TIMEOUT)
 
     @handle_token_error
     async def get_trade(self, order_id: str) -> Optional[Trade]:
@@ -192,9 +366,21 @@ class Shioaji:
         if price is None and quantity is None:
             raise ValueError("price 和 quantity 不能同時為 None")
         if price is None and quantity is not None:
-            await asyncio.to_thread(self.api.update_order, trade, qty=quantity)
+            await self._call(
+                self.api.update_order,
+                trade,
+                qty=quantity,
+                timeout=ORDER_TIMEOUT,
+                idempotent=False,
+            )
         elif price is not None and quantity is None:
-            await asyncio.to_thread(self.api.update_order, trade, price=price)
+            await self._call(
+                self.api.update_order,
+                trade,
+                price=price,
+                timeout=ORDER_TIMEOUT,
+                idempotent=False,
+            )
         else:
             raise ValueError("price 和 quantity 不能同時有值")
 
@@ -206,4 +392,6 @@ class Shioaji:
         Args:
             trade (Trade): 成交紀錄
         """
-        await asyncio.to_thread(self.api.cancel_order, trade)
+        await self._call(
+            self.api.cancel_order, trade, timeout=ORDER_TIMEOUT, idempotent=False
+        )
@@ -0,0 +1,95 @@
+import asyncio
+import contextlib
+import logging
+from typing import AsyncIterator, Awaitable, Callable, Iterable, TypeVar
+
+__all__ = ("ShutdownCoordinator", "ShuttingDown")
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class ShuttingDown(Exception):
+    """系統關閉中, 不再接受新的請求"""
+
+
+class ShutdownCoordinator:
+    """
+    追蹤進行中的請求, 並在關閉時等待它們完成
+
+    Args:
+        drain_timeout (float): 等待進行中請求完成的時間上限 (秒)
+        concurrency (int): 關閉時同時執行的清理工作數量上限
+    """
+
+    def __init__(self, *, drain_timeout: float = 10.0, concurrency: int = 5) -> None:
+        self.drain_timeout = drain_timeout
+        self.concurrency = concurrency
+        self.closing = False
+        self._in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @contextlib.asynccontextmanager
+    async def track(self) -> AsyncIterator[None]:
+        """
+        追蹤一個進行中的請求
+
+        Raises:
+            ShuttingDown: 系統關閉中
+        """
+        if self.closing:
+            raise ShuttingDown
+        self._in_flight += 1
+        self._idle.clear()
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                self._idle.set()
+
+    async def drain(self) -> bool:
+        """
+        停止接受新的請求, 並等待進行中的請求完成
+
+        Returns:
+            bool: 是否所有請求都在時間內完成
+        """
+        self.closing = True
+        try:
+            await asyncio.wait_for(self._idle.wait(), self.drain_timeout)
+        except asyncio.TimeoutError:
+            log.warning(
+                "%d handler(s) still running after %.1fs, shutting down anyway",
+                self._in_flight,
+                self.drain_timeout,
+            )
+            return False
+        return True
+
+    async def run_all(
+        self, func: Callable[[T], Awaitable[None]], items: Iterable[T]
+    ) -> None:
+        """
+        以有限的並行數量對每個項目執行清理工作, 個別失敗只會記錄不會中斷
+
+        Args:
+            func (Callable[[T], Awaitable[None]]): 清理工作
+            items (Iterable[T]): 項目
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(item: T) -> None:
+            async with semaphore:
+                try:
+                    await func(item)
+                except Exception:
+                    log.exception("Shutdown task failed")
+
+        await asyncio.gather(*(run(item) for item in items))
@@ -0,0 +1,63 @@
+import hashlib
+import json
+import logging
+from pathlib import Path
+from typing import Optional
+
+__all__ = ("Snapshot",)
+
+log = logging.getLogger(__name__)
+
+
+class Snapshot:
+    """
+    啟動快照, 用於加速冷啟動
+
+    Attributes:
+        rich_menu_id (Optional[str]): 上次建立的導覽列 ID
+        rich_menu_digest (Optional[str]): 上次建立導覽列時的設定與圖片雜湊
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        *,
+        rich_menu_id: Optional[str] = None,
+        rich_menu_digest: Optional[str] = None,
+    ) -> None:
+        self.path = path
+        self.rich_menu_id = rich_menu_id
+        self.rich_menu_digest = rich_menu_digest
+
+    @classmethod
+    def load(cls, path: Path) -> "Snapshot":
+        if not path.exists():
+            return cls(path)
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            data = None
+        if not isinstance(data, dict):
+            log.warning("Snapshot at %s is unreadable, ignoring", path)
+            return cls(path)
+        return cls(
+            path,
+            rich_menu_id=data.get("rich_menu_id"),
+            rich_menu_digest=data.get("rich_menu_digest"),
+        )
+
+    def save(self) -> None:
+        data = {
+            "rich_menu_id": self.rich_menu_id,
+            "rich_menu_digest": self.rich_menu_digest,
+        }
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(self.path)
+
+    @staticmethod
+    def digest(*parts: bytes) -> str:
+        sha = hashlib.sha256()
+        for part in parts:
+            sha.update(part)
+        return sha.hexdigest()
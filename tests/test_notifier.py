@@ -0,0 +1,78 @@
+import asyncio
+from types import SimpleNamespace
+from typing import Any, List
+
+from stock_buyer.notifier import (
+    EVENTS_PER_MESSAGE,
+    MESSAGES_PER_PUSH,
+    OrderEvent,
+    OrderNotifier,
+    SimulatedOrderEventSource,
+)
+
+WINDOW = 0.05
+
+
+class FakeLineBotApi:
+    def __init__(self) -> None:
+        self.pushes: List[Any] = []
+
+    async def push_message(self, request: Any) -> None:
+        self.pushes.append(request)
+
+
+def make_notifier() -> OrderNotifier:
+    bot = SimpleNamespace(line_bot_api=FakeLineBotApi())
+    return OrderNotifier(bot, window=WINDOW)  # type: ignore
+
+
+def deal(order_id: str) -> OrderEvent:
+    return OrderEvent("deal", order_id, "2330", "Buy", 600.0, 1)
+
+
+def test_events_within_window_are_coalesced_per_user() -> None:
+    notifier = make_notifier()
+    pushes = notifier.bot.line_bot_api.pushes
+
+    async def main() -> None:
+        first, second = SimulatedOrderEventSource(), SimulatedOrderEventSource()
+        notifier.attach("u1", first)
+        notifier.attach("u2", second)
+
+        for i in range(3):
+            first.emit(deal(str(i)))
+        second.emit(OrderEvent("cancel", "9", "0050", "Sell", 150.0, 2))
+        await asyncio.sleep(WINDOW * 4)
+
+        assert len(pushes) == 2
+        by_user = {push.to: push for push in pushes}
+        assert len(by_user["u1"].messages) == 1
+        assert by_user["u1"].messages[0].text.count("\n") == 2
+        assert "已刪單 [0050] 賣 2" in by_user["u2"].messages[0].text
+
+        # An event after the window is pushed separately
+        first.emit(deal("3"))
+        await asyncio.sleep(WINDOW * 4)
+        assert len(pushes) == 3
+
+    asyncio.run(main())
+
+
+def test_large_batches_are_split_into_messages_and_pushes() -> None:
+    notifier = make_notifier()
+    pushes = notifier.bot.line_bot_api.pushes
+    count = EVENTS_PER_MESSAGE * MESSAGES_PER_PUSH + 1
+
+    async def main() -> None:
+        source = SimulatedOrderEventSource()
+        notifier.attach("u1", source)
+        for i in range(count):
+            source.emit(deal(str(i)), threaded=False)
+        await asyncio.sleep(0)  # let call_soon_threadsafe callbacks run
+        await notifier.flush_all()
+
+    asyncio.run(main())
+    assert [len(push.messages) for push in pushes] == [MESSAGES_PER_PUSH, 1]
+    texts = [message.text for push in pushes for message in push.messages]
+    assert all(text.count("\n") == EVENTS_PER_MESSAGE - 1 for text in texts[:-1])
+    assert texts[-1].count("\n") == 0
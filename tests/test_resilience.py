@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+
+from stock_buyer.resilience import (
+    CircuitBreaker,
+    CircuitBreakerRegistry,
+    CircuitOpenError,
+    DependencyTimeout,
+    ResultUnknown,
+)
+
+
+class FakeTime:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+async def slow() -> None:
+    await asyncio.sleep(1)
+
+
+async def ok() -> str:
+    return "ok"
+
+
+async def refused() -> None:
+    raise ConnectionRefusedError
+
+
+async def rejected() -> None:
+    raise RuntimeError("尚未登入")
+
+
+def make_breaker(clock: FakeTime) -> CircuitBreaker:
+    return CircuitBreaker(
+        "broker", failure_threshold=2, recovery_timeout=5, clock=clock
+    )
+
+
+def test_opens_after_timeouts_and_recovers_through_probe() -> None:
+    clock = FakeTime()
+    breaker = make_breaker(clock)
+
+    async def main() -> None:
+        for _ in range(2):
+            with pytest.raises(DependencyTimeout):
+                await breaker.call(slow, timeout=0.01)
+        with pytest.raises(CircuitOpenError):
+            await breaker.call(ok)
+
+        clock.now = 5
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert await breaker.call(ok) == "ok"
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    asyncio.run(main())
+    metrics = breaker.metrics()
+    assert metrics["timeouts"] == 2
+    assert metrics["rejected"] == 1
+    assert metrics["opened"] == 1
+
+
+def test_failed_probe_reopens() -> None:
+    clock = FakeTime()
+    breaker = make_breaker(clock)
+
+    async def main() -> None:
+        for _ in range(2):
+            with pytest.raises(ConnectionRefusedError):
+                await breaker.call(refused)
+        clock.now = 5
+        with pytest.raises(ConnectionRefusedError):
+            await breaker.call(refused)
+
+    asyncio.run(main())
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_account_errors_do_not_open_circuit() -> None:
+    breaker = make_breaker(FakeTime())
+
+    async def main() -> None:
+        for _ in range(5):
+            with pytest.raises(RuntimeError):
+                await breaker.call(rejected)
+
+    asyncio.run(main())
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.metrics()["failures"] == 0
+
+
+def test_non_idempotent_timeout_reports_unknown_result() -> None:
+    breaker = make_breaker(FakeTime())
+
+    async def main() -> None:
+        with pytest.raises(ResultUnknown):
+            await breaker.call(slow, timeout=0.01, idempotent=False)
+
+    asyncio.run(main())
+
+
+def test_scoped_breakers_are_independent_and_share_service_options() -> None:
+    registry = CircuitBreakerRegistry()
+    registry.configure("shioaji", failure_threshold=1)
+
+    async def main() -> None:
+        with pytest.raises(ConnectionRefusedError):
+            await registry.get("shioaji:U1").call(refused)
+        with pytest.raises(CircuitOpenError):
+            await registry.get("shioaji:U1").call(ok)
+        assert await registry.get("shioaji:U2").call(ok) == "ok"
+
+    asyncio.run(main())
+    assert registry.get("shioaji:U2").failure_threshold == 1
+    assert set(registry.metrics()) == {"shioaji:U1", "shioaji:U2"}
+
+
+def test_failures_are_configurable() -> None:
+    breaker = CircuitBreaker(
+        "crawl",
+        failure_threshold=1,
+        is_failure=lambda error: isinstance(error, RuntimeError),
+    )
+
+    async def main() -> None:
+        with pytest.raises(RuntimeError):
+            await breaker.call(rejected)
+
+    asyncio.run(main())
+    assert breaker.state == CircuitBreaker.OPEN
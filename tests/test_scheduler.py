@@ -0,0 +1,107 @@
+import asyncio
+import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from stock_buyer.scheduler import TAIPEI, Clock, PreMarketScheduler, TradingCalendar
+
+
+class FakeClock(Clock):
+    def __init__(self, now: datetime.datetime) -> None:
+        self.current = now
+        self.sleeps: list[float] = []
+
+    def now(self) -> datetime.datetime:
+        return self.current
+
+    async def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.current += datetime.timedelta(seconds=seconds)
+
+
+class FakeAccount:
+    def __init__(self, codes: list[str]) -> None:
+        self.codes = codes
+        self.calls: list[str] = []
+
+    async def refresh(self) -> None:
+        self.calls.append("refresh")
+
+    async def fetch_contracts(self) -> None:
+        self.calls.append("fetch_contracts")
+
+    async def list_positions(self) -> list[SimpleNamespace]:
+        self.calls.append("list_positions")
+        return [SimpleNamespace(code=code) for code in self.codes]
+
+
+class FakeCrawl:
+    def __init__(self) -> None:
+        self.fetched: list[str] = []
+
+    async def fetch_stock(self, stock_id: str) -> SimpleNamespace:
+        self.fetched.append(stock_id)
+        return SimpleNamespace(id=stock_id)
+
+    async def fetch_stock_last_close_price(self, stock_id: str) -> float:
+        return 0.0
+
+
+def taipei(*args: int) -> datetime.datetime:
+    return datetime.datetime(*args, tzinfo=TAIPEI)
+
+
+def make_scheduler(now: datetime.datetime, **kwargs) -> PreMarketScheduler:
+    bot = SimpleNamespace(shioaji_accs={}, crawl=FakeCrawl())
+    return PreMarketScheduler(bot, clock=FakeClock(now), **kwargs)  # type: ignore
+
+
+def test_next_run_same_day_before_warmup() -> None:
+    scheduler = make_scheduler(taipei(2026, 10, 15, 7, 0), calendar=TradingCalendar())
+    assert scheduler.next_run() == taipei(2026, 10, 15, 8, 0)
+
+
+def test_next_run_skips_weekend_and_holidays() -> None:
+    # Friday after the warmup, Monday is a holiday
+    scheduler = make_scheduler(
+        taipei(2026, 10, 16, 9, 0),
+        calendar=TradingCalendar([datetime.date(2026, 10, 19)]),
+    )
+    assert scheduler.next_run() == taipei(2026, 10, 20, 8, 0)
+
+
+def test_warmup_spaces_accounts_and_warms_crawl() -> None:
+    scheduler = make_scheduler(
+        taipei(2026, 10, 15, 8, 0),
+        calendar=TradingCalendar(),
+        spacing=3.0,
+        crawl_spacing=0.5,
+    )
+    accounts = {"a": FakeAccount(["2330"]), "b": FakeAccount(["2330", "0050"])}
+    scheduler.bot.shioaji_accs = accounts
+
+    asyncio.run(scheduler.warmup())
+
+    # One gap between the two accounts, one between the two stocks
+    assert scheduler.clock.sleeps == [3.0, 0.5]  # type: ignore
+    for account in accounts.values():
+        assert account.calls == ["refresh", "fetch_contracts", "list_positions"]
+    assert scheduler.bot.crawl.fetched == ["0050", "2330"]
+
+
+def test_run_sleeps_until_next_trading_day() -> None:
+    clock_start = taipei(2026, 10, 16, 9, 0)  # Friday, after the warmup
+    scheduler = make_scheduler(clock_start, calendar=TradingCalendar())
+    warmups: list[datetime.datetime] = []
+
+    async def warmup() -> None:
+        warmups.append(scheduler.clock.now())
+        if len(warmups) == 2:
+            raise asyncio.CancelledError
+
+    scheduler.warmup = warmup  # type: ignore
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(scheduler.run())
+
+    assert warmups == [taipei(2026, 10, 19, 8, 0), taipei(2026, 10, 20, 8, 0)]
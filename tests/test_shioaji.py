@@ -0,0 +1,43 @@
+from typing import Any, Dict
+
+from shioaji.constant import OrderState
+
+from stock_buyer.notifier import OrderEvent
+from stock_buyer.shioaji import to_order_event
+
+
+def order_msg(op_type: str, op_code: str) -> Dict[str, Any]:
+    return {
+        "operation": {"op_type": op_type, "op_code": op_code, "op_msg": ""},
+        "order": {"id": "a1", "action": "Sell", "price": 150.0, "quantity": 5},
+        "status": {"cancel_quantity": 3},
+        "contract": {"code": "0050"},
+    }
+
+
+def test_deal() -> None:
+    msg = {
+        "trade_id": "a1",
+        "code": "2330",
+        "action": "Buy",
+        "price": 600.0,
+        "quantity": 2,
+    }
+    assert to_order_event(OrderState.StockDeal, msg) == OrderEvent(
+        "deal", "a1", "2330", "Buy", 600.0, 2
+    )
+
+
+def test_successful_cancel_reports_cancelled_quantity() -> None:
+    assert to_order_event(OrderState.StockOrder, order_msg("Cancel", "00")) == (
+        OrderEvent("cancel", "a1", "0050", "Sell", 150.0, 3)
+    )
+
+
+def test_failed_cancel_is_ignored() -> None:
+    assert to_order_event(OrderState.StockOrder, order_msg("Cancel", "88")) is None
+
+
+def test_other_order_operations_are_ignored() -> None:
+    assert to_order_event(OrderState.StockOrder, order_msg("New", "00")) is None
+    assert to_order_event(OrderState.StockOrder, order_msg("UpdateQty", "00")) is None
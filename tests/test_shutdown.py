@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+from stock_buyer.shutdown import ShutdownCoordinator, ShuttingDown
+
+
+def test_drain_waits_for_tracked_handlers() -> None:
+    coordinator = ShutdownCoordinator(drain_timeout=1.0)
+    finished: list[str] = []
+
+    async def handler() -> None:
+        async with coordinator.track():
+            await asyncio.sleep(0.05)
+            finished.append("handler")
+
+    async def main() -> bool:
+        task = asyncio.create_task(handler())
+        await asyncio.sleep(0)
+        assert coordinator.in_flight == 1
+        drained = await coordinator.drain()
+        finished.append("drained")
+        await task
+        return drained
+
+    assert asyncio.run(main()) is True
+    assert finished == ["handler", "drained"]
+    assert coordinator.in_flight == 0
+
+
+def test_drain_returns_false_at_deadline() -> None:
+    coordinator = ShutdownCoordinator(drain_timeout=0.05)
+
+    async def main() -> bool:
+        release = asyncio.Event()
+
+        async def handler() -> None:
+            async with coordinator.track():
+                await release.wait()
+
+        task = asyncio.create_task(handler())
+        await asyncio.sleep(0)
+        drained = await coordinator.drain()
+        assert coordinator.in_flight == 1
+        release.set()
+        await task
+        return drained
+
+    assert asyncio.run(main()) is False
+
+
+def test_track_raises_once_closing() -> None:
+    coordinator = ShutdownCoordinator(drain_timeout=0.05)
+
+    async def main() -> None:
+        await coordinator.drain()
+        with pytest.raises(ShuttingDown):
+            async with coordinator.track():
+                pass
+
+    asyncio.run(main())
+    assert coordinator.closing
+    assert coordinator.in_flight == 0
+
+
+def test_run_all_respects_concurrency_and_isolates_failures() -> None:
+    coordinator = ShutdownCoordinator(concurrency=2)
+    running = 0
+    peak = 0
+    done: list[int] = []
+
+    async def task(item: int) -> None:
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        try:
+            await asyncio.sleep(0.01)
+            if item == 2:
+                raise RuntimeError("logout failed")
+            done.append(item)
+        finally:
+            running -= 1
+
+    asyncio.run(coordinator.run_all(task, range(6)))
+    assert peak == 2
+    assert sorted(done) == [0, 1, 3, 4, 5]
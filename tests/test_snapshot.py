@@ -0,0 +1,43 @@
+import json
+from pathlib import Path
+
+from stock_buyer.snapshot import Snapshot
+
+
+def test_missing_file_loads_empty(tmp_path: Path) -> None:
+    snapshot = Snapshot.load(tmp_path / "snapshot.json")
+    assert snapshot.rich_menu_id is None
+    assert snapshot.rich_menu_digest is None
+
+
+def test_save_and_load_round_trip(tmp_path: Path) -> None:
+    path = tmp_path / "snapshot.json"
+    Snapshot(path, rich_menu_id="richmenu-1", rich_menu_digest="abc").save()
+
+    snapshot = Snapshot.load(path)
+    assert snapshot.rich_menu_id == "richmenu-1"
+    assert snapshot.rich_menu_digest == "abc"
+    assert not path.with_suffix(".tmp").exists()
+
+
+def test_corrupt_file_is_ignored(tmp_path: Path) -> None:
+    path = tmp_path / "snapshot.json"
+    path.write_text("{not json", encoding="utf-8")
+    assert Snapshot.load(path).rich_menu_id is None
+
+    path.write_text(json.dumps(["not", "a", "dict"]), encoding="utf-8")
+    assert Snapshot.load(path).rich_menu_id is None
+
+
+def test_unknown_keys_are_ignored(tmp_path: Path) -> None:
+    path = tmp_path / "snapshot.json"
+    path.write_text(
+        json.dumps({"rich_menu_id": "richmenu-1", "user_ids": ["U1"]}),
+        encoding="utf-8",
+    )
+    assert Snapshot.load(path).rich_menu_id == "richmenu-1"
+
+
+def test_digest_depends_on_every_part() -> None:
+    assert Snapshot.digest(b"menu", b"image") == Snapshot.digest(b"menu", b"image")
+    assert Snapshot.digest(b"menu", b"image") != Snapshot.digest(b"menu", b"other")